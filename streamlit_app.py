@@ -1,14 +1,20 @@
 import streamlit as st
 import pandas as pd
-import xml.etree.ElementTree as ET
+from lxml import etree
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+from dataclasses import dataclass, asdict
 from collections import defaultdict
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
 from io import BytesIO
 from PIL import Image
 import requests
 import plotly.express as px
 import re
+import unicodedata
+import hashlib
 
 # Define TEI XML namespace
 NS = {
@@ -16,6 +22,54 @@ NS = {
     'xml': 'http://www.w3.org/XML/1998/namespace'
 }
 
+# Shared lxml parser: blank text is kept for Leiden+, comments/PIs are dropped, and only
+# entities declared inside the file are resolved (no DTD loading, no network access)
+_PARSER_OPTIONS = dict(
+    huge_tree=False,
+    remove_blank_text=False,
+    collect_ids=False,
+    load_dtd=False,
+    no_network=True,
+    resolve_entities='internal',
+    remove_comments=True,
+    remove_pis=True
+)
+_LXML_PARSER = etree.XMLParser(**_PARSER_OPTIONS)
+
+@lru_cache(maxsize=None)
+def compile_xpath(expr):
+    """
+    Compile an XPath expression against the TEI namespace map.
+    Results are cached, so every distinct expression is only parsed once per script run,
+    however many documents it is evaluated on; each rerun starts with an empty cache.
+    """
+    return etree.XPath(expr, namespaces=NS)
+
+# XPath expressions compiled once per script run and used for every uploaded document
+_XP_EDITOR_NAMES = compile_xpath("tei:editor/tei:persName")
+_XP_ALT_IDENTIFIER_EN = compile_xpath("tei:altIdentifier[@xml:lang='en']")
+_XP_REPOSITORY_REF = compile_xpath("tei:repository[1]/tei:ref")
+_XP_FOUND_PLACE_EN = compile_xpath("tei:provenance[@type='found'][1]/tei:seg[@xml:lang='en']")
+_XP_ORIG_PLACE_EN = compile_xpath("tei:origPlace[1]/tei:seg[@xml:lang='en']")
+_XP_ORIG_DATE_EN = compile_xpath("tei:origDate[1]/tei:seg[@xml:lang='en']")
+_XP_SEG_EN = compile_xpath("tei:seg[@xml:lang='en']")
+_XP_FACSIMILES = compile_xpath("tei:facsimile")
+_XP_GRAPHIC_URL = compile_xpath("tei:graphic[1]/@url")
+_XP_APP_NOTE_EN = compile_xpath(".//tei:app[@xml:lang='en']/tei:note[1]")
+_XP_BIBL = compile_xpath(".//tei:bibl")
+_XP_SEARCHABLE_DIVS = compile_xpath(
+    "tei:text[1]/tei:body[1]/tei:div[(@type='edition' and @xml:lang='grc')"
+    " or @type='translation' or @type='commentary' or @type='bibliography']"
+)
+
+def first_text(nodes, default=""):
+    """
+    Return the stripped text of the first node in an XPath result list, or the default.
+    """
+    if nodes and nodes[0].text:
+        return nodes[0].text.strip()
+    return default
+
 st.sidebar.header("Project Information")
 st.sidebar.markdown("""
     **Epigraphic Database Viewer** is a tool designed to visualize and analyze ancient inscriptions.
@@ -36,16 +90,9 @@ def safe_find_text(elem, xpath, default="", lang=None):
     """
     if elem is None:
         return default
-    try:
-        if lang:
-            xpath = f"{xpath}[@xml:lang='{lang}']"
-        found = elem.find(xpath, NS)
-        if found is not None and found.text:
-            return found.text.strip()
-        return default
-    except Exception as e:
-        st.warning(f"Error extracting text using xpath {xpath}: {str(e)}")
-        return default
+    if lang:
+        xpath = f"{xpath}[@xml:lang='{lang}']"
+    return first_text(compile_xpath(xpath)(elem), default)
 
 def safe_get_attr(elem, attr_name, default=""):
     """
@@ -53,266 +100,357 @@ def safe_get_attr(elem, attr_name, default=""):
     """
     if elem is None:
         return default
-    try:
-        return elem.get(attr_name, default)
-    except Exception as e:
-        st.warning(f"Error getting attribute {attr_name}: {str(e)}")
-        return default
+    return elem.get(attr_name, default)
+
+# Namespace prefix of Clark-notation TEI tags, sliced off to get local names without splitting
+_TEI_NS_PREFIX = f"{{{NS['tei']}}}"
+_TEI_NS_LEN = len(_TEI_NS_PREFIX)
+
+_DIV_TAG = f"{{{NS['tei']}}}div"
+_CHOICE_TAGS = tuple(f"{{{NS['tei']}}}{tag}" for tag in ("corr", "sic", "reg", "orig"))
+_EXPAN_TAGS = tuple(f"{{{NS['tei']}}}{tag}" for tag in ("abbr", "ex"))
+
+def child_texts(elem, names, lang=None):
+    """
+    Return the stripped texts of the first TEI child of elem with each of the given local
+    names, optionally only counting children with that xml:lang, in one pass over the
+    children. Returns a tuple in the order of names, with "" for anything missing.
+    """
+    if elem is None:
+        return ("",) * len(names)
+    values = {}
+    for child in elem.iterchildren(*(_TEI_NS_PREFIX + name for name in names)):
+        name = child.tag[_TEI_NS_LEN:]
+        if name not in values and (lang is None or child.get(_XML_LANG) == lang):
+            values[name] = (child.text or "").strip()
+    return tuple(values.get(name, "") for name in names)
 
 def validate_dimensions(dimensions_elem):
     """
-    Validate and extract dimensions from a dimensions element.
-    Returns a tuple of (height, width, depth) with appropriate warnings for missing values.
+    Extract dimensions from a dimensions element in one pass over its children.
+    Returns a tuple of (height, width, depth); missing values are empty strings.
     """
-    if dimensions_elem is None:
-        return ("", "", "")
-    
-    height = width = depth = ""
-    warnings = []
-    
-    try:
-        height_elem = dimensions_elem.find("tei:height", NS)
-        if height_elem is not None and height_elem.text:
-            height = height_elem.text.strip()
-        else:
-            warnings.append("height")
-            
-        width_elem = dimensions_elem.find("tei:width", NS)
-        if width_elem is not None and width_elem.text:
-            width = width_elem.text.strip()
-        else:
-            warnings.append("width")
-            
-        depth_elem = dimensions_elem.find("tei:depth", NS)
-        if depth_elem is not None and depth_elem.text:
-            depth = depth_elem.text.strip()
-        else:
-            warnings.append("depth")
-            
-        if warnings:
-            st.warning(f"Missing dimension values: {', '.join(warnings)}")
-            
-    except Exception as e:
-        st.error(f"Error processing dimensions: {str(e)}")
-        return ("", "", "")
-        
-    return (height, width, depth)
+    return child_texts(dimensions_elem, ("height", "width", "depth"))
+
+def xpath_text(elem, xpath):
+    """
+    Return the stripped text of the first result of a compiled XPath evaluated on elem,
+    or "" if elem is None or nothing matches.
+    """
+    if elem is None:
+        return ""
+    return first_text(xpath(elem))
 
 def get_text(elem, xpath, lang=None):
     """
     Helper function to fetch text content for a given XPath.
     Optionally filters by xml:lang attribute.
     """
+    if elem is None:
+        return ""
     if lang:
         xpath = f"{xpath}[@xml:lang='{lang}']"
-    found = elem.find(xpath, NS)
-    if found is not None and found.text:
-        return found.text.strip()
-    return ""
+    return first_text(compile_xpath(xpath)(elem))
 
-def parse_tei(file):
-    try:
-        # Make sure we're at the start of the file
-        file.seek(0)
-        tree = ET.parse(file)
-        root = tree.getroot()
+# Structural TEI elements used by the visualization tab, collected in one tree walk
+SECTION_TAGS = tuple(f"{{{NS['tei']}}}{name}" for name in (
+    "titleStmt", "publicationStmt", "msIdentifier", "summary",
+    "support", "dimensions", "layoutDesc", "handNote", "history", "origin", "body"
+))
+
+def collect_sections(root):
+    """
+    Walk the document once and collect the structural elements listed in SECTION_TAGS,
+    keyed by their local tag name. Only the first occurrence (in document order) is kept.
+    """
+    sections = {}
+    for elem in root.iter(*SECTION_TAGS):
+        sections.setdefault(elem.tag[_TEI_NS_LEN:], elem)
+    return sections
+
+_XML_LANG = f"{{{NS['xml']}}}lang"
+_TEI_TAG = f"{{{NS['tei']}}}TEI"
+_TEI_HEADER_TAG = f"{{{NS['tei']}}}teiHeader"
+_TEXT_TAG = f"{{{NS['tei']}}}text"
+
+# Problems found while loading files, as (level, message) pairs, shown together by flush_diagnostics()
+_diagnostics = []
+
+def flush_diagnostics():
+    """
+    Show all buffered diagnostics in the UI, one error box and one warning box at most,
+    and clear the buffer.
+    """
+    errors = [message for level, message in _diagnostics if level == "error"]
+    warning_messages = [message for level, message in _diagnostics if level == "warning"]
+    if errors:
+        st.error("\n\n".join(errors))
+    if warning_messages:
+        st.warning("\n\n".join(warning_messages))
+    _diagnostics.clear()
+
+def validate_tei(file_name, root):
+    """
+    Check the basic TEI structure of a parsed file: the root tag and the tags of its children.
+    Returns a tuple of (usable, problems): usable is False if the file is not a usable TEI
+    document, and problems is a list of (level, message) pairs for _diagnostics.
+    """
+    problems = []
+    # Validate basic TEI structure
+    if root.tag != _TEI_TAG:
+        problems.append(("warning", f"Warning: File {file_name} doesn't appear to be a valid TEI document. Root element is {root.tag}"))
+        return False, problems
         
-        # Validate basic TEI structure
-        if root.tag != "{http://www.tei-c.org/ns/1.0}TEI":
-            st.warning(f"Warning: File {file.name} doesn't appear to be a valid TEI document. Root element is {root.tag}")
-            return None, ""
-            
-        # Check for required major sections
-        tei_header = root.find("tei:teiHeader", NS)
-        text_elem = root.find("tei:text", NS)
+    # Check for required major sections
+    child_tags = {child.tag for child in root.iterchildren()}
+    if _TEI_HEADER_TAG not in child_tags:
+        problems.append(("warning", f"Warning: File {file_name} is missing teiHeader section"))
+    if _TEXT_TAG not in child_tags:
+        problems.append(("warning", f"Warning: File {file_name} is missing text section"))
         
-        if tei_header is None:
-            st.warning(f"Warning: File {file.name} is missing teiHeader section")
-        if text_elem is None:
-            st.warning(f"Warning: File {file.name} is missing text section")
-            
-        return root, ET.tostring(root, encoding="unicode")
-    except ET.ParseError as e:
-        st.error(f"XML Parsing Error in file {file.name}: {str(e)}")
-        return None, ""
-    except Exception as e:
-        st.error(f"Error processing file {file.name}: {str(e)}")
-        return None, ""
+    return True, problems
+
+# --- Leiden+ tag handlers ---
+# Each handler appends the formatted fragment for one child element to `parts`.
+# Container handlers return the closing markup (possibly empty) to signal that
+# format_leiden_text should descend into the element's children; leaf handlers return None.
+
+# Line breaks (no newline when the word continues across the break)
+def _h_lb(child, parts):
+    if child.get('break') != 'no':
+        parts.append('\n')
+
+# Text divisions
+def _h_div(child, parts):
+    if child.get('type') == 'textpart':
+        n = child.get('n') or ''
+        parts.append(f'<D=.{n} ')
+        return ' =D>'
+    return ''
+
+# Unclear letters
+def _h_unclear(child, parts):
+    # Dot below every letter: interleave the combining mark and close with one more
+    if child.text:
+        parts.append('\u0323'.join(child.text) + '\u0323')
+
+# Original letters
+def _h_orig(child, parts):
+    parts.append(f'={child.text or ""}=')
+
+# Supplied text, keyed by @reason: (text, cert) -> formatted
+_SUPPLIED_FMT = {
+    'lost': lambda sup, cert: f'[{sup}{"?" if cert == "low" else ""}]',
+    'undefined': lambda sup, cert: f'_[{sup}]_',
+    'omitted': lambda sup, cert: f'<{sup}>',
+    'subaudible': lambda sup, cert: f'({sup})',
+}
+
+def _h_supplied(child, parts):
+    get = child.get
+    sup = child.text or ''
+    fmt = _SUPPLIED_FMT.get(get('reason'))
+    parts.append(fmt(sup, get('cert')) if fmt else sup)
+
+# Gaps, keyed by @unit: (quantity, extent, precision) -> formatted
+_GAP_FMT = {
+    'character': lambda qty, extent, precision: (
+        '[.?]' if extent == 'unknown'
+        else f'[.{qty}]' if precision == 'low'
+        else '[' + '.' * int(qty or 0) + ']'
+    ),
+    'line': lambda qty, extent, precision: (
+        '(Lines: ? non transcribed)' if extent == 'unknown'
+        else f'(Lines: {qty} non transcribed)'
+    ),
+}
+
+def _h_gap(child, parts):
+    get = child.get
+    # Ellipsis
+    if get('reason') == 'ellipsis':
+        parts.append('...')
+        return
+    fmt = _GAP_FMT.get(get('unit'))
+    if fmt:
+        parts.append(fmt(get('quantity') or '', get('extent'), get('precision')))
+
+# Deletions
+def _h_del(child, parts):
+    inner = ''.join(child.itertext())
+    if child.get('rend') == 'erasure':
+        parts.append(f'〚{inner}〛')
+    else:
+        parts.append(inner)
+
+# Additions
+def _h_add(child, parts):
+    place = child.get('place')
+    inner = child.text or ''
+    if place == 'overstrike':
+        parts.append(f'《{inner}》')
+    elif place == 'above':
+        parts.append(f'`{inner}´')
+    elif place == 'below':
+        parts.append(f'/{inner}\\')
+    else:
+        parts.append(inner)
+
+# Corrections and regularizations
+def _h_choice(child, parts):
+    # First child of each kind, collected in one pass over the children
+    found = {}
+    for option in child.iterchildren(*_CHOICE_TAGS):
+        found.setdefault(option.tag[_TEI_NS_LEN:], option)
+    corr = found.get('corr')
+    sic = found.get('sic')
+    reg = found.get('reg')
+    orig = found.get('orig')
+    if corr is not None and sic is not None:
+        parts.append(f'<{corr.text}|corr|{sic.text}>')
+    elif reg is not None and orig is not None:
+        parts.append(f'<{orig.text}|reg|{reg.text}>')
+    else:
+        parts.append(''.join(child.itertext()))
+
+# Highlighting
+def _h_hi(child, parts):
+    rend = child.get('rend')
+    inner = child.text or ''
+    if rend == 'apex':
+        parts.append(f'{inner}(΄)')
+    elif rend == 'supraline':
+        parts.append(f'{inner}¯')
+    elif rend == 'ligature':
+        parts.append(f'{inner}\u0361')
+    else:
+        parts.append(inner)
+
+# Abbreviation expansions
+def _h_expan(child, parts):
+    found = {}
+    for part in child.iterchildren(*_EXPAN_TAGS):
+        found.setdefault(part.tag[_TEI_NS_LEN:], part)
+    abbr = found.get('abbr')
+    ex = found.get('ex')
+    if abbr is not None and ex is not None:
+        cert = ex.get('cert')
+        parts.append(f"{abbr.text}({ex.text}{'?' if cert=='low' else ''})")
+
+# Abbreviations, expansions, numerals
+def _h_plain(child, parts):
+    parts.append(child.text or '')
+
+# Symbols
+def _h_g(child, parts):
+    type_ = child.get('type')
+    if type_:
+        parts.append(f'*{type_}*')
+
+# Superfluous letters
+def _h_surplus(child, parts):
+    parts.append(f'{{{child.text or ""}}}')
+
+# Notes
+def _h_note(child, parts):
+    note = child.text or ''
+    if note in ('!', 'sic', 'e.g.'):
+        parts.append(f'/*{note}*/')
+    else:
+        parts.append(f'({note})')
+
+# Spaces on stone, keyed by @unit: (quantity, extent) -> formatted
+_SPACE_FMT = {
+    'character': lambda qty, extent: 'vac.?' if extent == 'unknown' else f'vac.{qty}',
+    'line': lambda qty, extent: 'vac.?lin' if extent == 'unknown' else f'vac.{qty}lin',
+}
+
+def _h_space(child, parts):
+    get = child.get
+    fmt = _SPACE_FMT.get(get('unit'))
+    if fmt:
+        parts.append(fmt(get('quantity'), get('extent')))
+
+# Word containers and any other element: descend into the children
+def _h_container(child, parts):
+    return ''
+
+LEIDEN_HANDLERS = {
+    'lb': _h_lb,
+    'div': _h_div,
+    'unclear': _h_unclear,
+    'orig': _h_orig,
+    'supplied': _h_supplied,
+    'gap': _h_gap,
+    'del': _h_del,
+    'add': _h_add,
+    'choice': _h_choice,
+    'hi': _h_hi,
+    'expan': _h_expan,
+    'abbr': _h_plain,
+    'ex': _h_plain,
+    'num': _h_plain,
+    'g': _h_g,
+    'surplus': _h_surplus,
+    'note': _h_note,
+    'space': _h_space,
+    'w': _h_container,
+}
+
+# LEIDEN_HANDLERS keyed by full TEI Clark tag, for the lookup in format_leiden_text
+_LEIDEN_DISPATCH = {_TEI_NS_PREFIX + tag: handler for tag, handler in LEIDEN_HANDLERS.items()}
 
 def format_leiden_text(elem):
     """
-    Recursively traverse the element tree to create a plain text version of the
-    Greek text (edition) with Leiden+ style formatting, covering full EpiDoc cases.
+    Traverse the element tree to create a plain text version of the Greek text (edition)
+    with Leiden+ style formatting, covering full EpiDoc cases.
+    The walk is iterative: container elements push their children, closing markup and
+    tail text onto an explicit stack, and all fragments are joined once at the end.
+    Per-tag formatting is dispatched through LEIDEN_HANDLERS.
     """
-    text = ''
+    parts = []
     if elem.text:
-        text += elem.text
-
-    for child in elem:
-        tag = child.tag.split('}')[-1]
-
-        # Line break without split
-        if tag == 'lb' and child.attrib.get('break') == 'no':
-            pass
-        # Line break
-        elif tag == 'lb':
-            text += '\n'
-
-        # Text divisions
-        elif tag == 'div' and child.attrib.get('type') == 'textpart':
-            n = child.attrib.get('n') or ''
-            inner = format_leiden_text(child)
-            text += f'<D=.{n} {inner} =D>'
-
-        # Unclear letters
-        elif tag == 'unclear':
-            for ch in (child.text or ''):
-                text += f'{ch}\u0323'
-
-        # Original letters
-        elif tag == 'orig':
-            text += f'={child.text or ""}='
-
-        # Supplied text
-        elif tag == 'supplied':
-            reason = child.attrib.get('reason')
-            cert = child.attrib.get('cert')
-            sup = child.text or ''
-            if reason == 'lost':
-                text += f'[{sup}{"?" if cert == "low" else ""}]'
-            elif reason == 'undefined':
-                text += f'_[{sup}]_'
-            elif reason == 'omitted':
-                text += f'<{sup}>'
-            elif reason == 'subaudible':
-                text += f'({sup})'
-            else:
-                text += sup
-
-        # Gaps
-        elif tag == 'gap':
-            # Ellipsis
-            if child.attrib.get('reason') == 'ellipsis':
-                text += '...'
+        parts.append(elem.text)
+
+    # Hot loop: bound methods are looked up once, and TEI tags are dispatched on their
+    # full Clark name so no local name has to be sliced off per element
+    emit = parts.append
+    dispatch = _LEIDEN_DISPATCH.get
+
+    # Stack items are either elements still to be formatted or literal strings to emit
+    stack = list(reversed(elem))
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        child = pop()
+        if child.__class__ is str:
+            emit(child)
+            continue
+
+        t = child.tag
+        handler = dispatch(t)
+        if handler is None:
+            if t.startswith(_TEI_NS_PREFIX):
+                handler = _h_container
             else:
-                unit = child.attrib.get('unit')
-                qty = child.attrib.get('quantity') or ''
-                extent = child.attrib.get('extent')
-                precision = child.attrib.get('precision')
-
-                if unit == 'character':
-                    if extent == 'unknown':
-                        text += '[.?]'
-                    elif precision == 'low':
-                        text += f'[.{qty}]'
-                    else:
-                        text += '[' + '.' * int(qty or 0) + ']'
-                elif unit == 'line':
-                    if extent == 'unknown':
-                        text += '(Lines: ? non transcribed)'
-                    else:
-                        text += f'(Lines: {qty} non transcribed)'
+                handler = LEIDEN_HANDLERS.get(etree.QName(t).localname, _h_container)
+        closing = handler(child, parts)
 
-        # Deletions
-        elif tag == 'del':
-            inner = ''.join(child.itertext())
-            if child.attrib.get('rend') == 'erasure':
-                text += f'〚{inner}〛'
-            else:
-                text += inner
-
-        # Additions
-        elif tag == 'add':
-            place = child.attrib.get('place')
-            inner = child.text or ''
-            if place == 'overstrike':
-                text += f'《{inner}》'
-            elif place == 'above':
-                text += f'`{inner}´'
-            elif place == 'below':
-                text += f'/{inner}\\'
-            else:
-                text += inner
-
-        # Corrections and regularizations
-        elif tag == 'choice':
-            corr = child.find('tei:corr', NS)
-            sic = child.find('tei:sic', NS)
-            reg = child.find('tei:reg', NS)
-            orig = child.find('tei:orig', NS)
-            if corr is not None and sic is not None:
-                text += f'<{corr.text}|corr|{sic.text}>'
-            elif reg is not None and orig is not None:
-                text += f'<{orig.text}|reg|{reg.text}>'
-            else:
-                text += ''.join(child.itertext())
-
-        # Highlighting
-        elif tag == 'hi':
-            rend = child.attrib.get('rend')
-            inner = child.text or ''
-            if rend == 'apex':
-                text += f'{inner}(΄)'
-            elif rend == 'supraline':
-                text += f'{inner}¯'
-            elif rend == 'ligature':
-                text += f'{inner}\u0361'
-            else:
-                text += inner
-
-        # Abbreviation expansions
-        elif tag == 'expan':
-            abbr = child.find('tei:abbr', NS)
-            ex = child.find('tei:ex', NS)
-            if abbr is not None and ex is not None:
-                cert = ex.attrib.get('cert')
-                text += f"{abbr.text}({ex.text}{'?' if cert=='low' else ''})"
-
-        # Abbreviations, expansions, numerals
-        elif tag in ('abbr', 'ex', 'num'):
-            text += child.text or ''
-
-        # Symbols
-        elif tag == 'g':
-            type_ = child.attrib.get('type')
-            if type_:
-                text += f'*{type_}*'
-
-        # Superfluous letters
-        elif tag == 'surplus':
-            text += f'{{{child.text or ""}}}'
-
-        # Notes
-        elif tag == 'note':
-            note = child.text or ''
-            if note in ('!', 'sic', 'e.g.'):
-                text += f'/*{note}*/'
-            else:
-                text += f'({note})'
-
-        # Spaces on stone
-        elif tag == 'space':
-            unit = child.attrib.get('unit')
-            qty = child.attrib.get('quantity')
-            extent = child.attrib.get('extent')
-            if unit == 'character':
-                text += 'vac.?' if extent=='unknown' else f'vac.{qty}'
-            elif unit == 'line':
-                text += 'vac.?lin' if extent=='unknown' else f'vac.{qty}lin'
-
-        # Word containers
-        elif tag == 'w':
-            text += format_leiden_text(child)
-
-        # Fallback
+        if closing is None:
+            # Leaf element: its tail follows immediately
+            if child.tail:
+                emit(child.tail)
         else:
-            text += format_leiden_text(child)
-
-        # Tail text
-        if child.tail:
-            text += child.tail
+            # Container: emit its text now, then children, closing markup and tail
+            if child.text:
+                emit(child.text)
+            if child.tail:
+                push(child.tail)
+            if closing:
+                push(closing)
+            stack.extend(reversed(child))
 
-    return text
+    return ''.join(parts)
 
 
 def extract_english_text(div, child_tag):
@@ -320,40 +458,481 @@ def extract_english_text(div, child_tag):
     Extract and join text from all elements with the given child_tag that have xml:lang="en".
     This function works for translation and commentary sections.
     """
-    texts = []
     if div is None:
         return ""
-    for elem in div.findall(f".//tei:{child_tag}", NS):
-        if elem.attrib.get("{http://www.w3.org/XML/1998/namespace}lang") == "en" and elem.text:
-            texts.append(elem.text.strip())
-    return "\n".join(texts)
+    return "\n".join(
+        elem.text.strip()
+        for elem in compile_xpath(f".//tei:{child_tag}[@xml:lang='en']")(div)
+        if elem.text
+    )
 
 def extract_apparatus_english(div):
     """
     Extract apparatus text from <app> elements in the apparatus section that have xml:lang="en".
     It searches for each <app> element with the attribute and extracts the text of its <note> child.
     """
-    texts = []
     if div is None:
         return ""
-    for app in div.findall(".//tei:app", NS):
-        if app.attrib.get("{http://www.w3.org/XML/1998/namespace}lang") == "en":
-            note = app.find("tei:note", NS)
-            if note is not None and note.text:
-                texts.append(note.text.strip())
-    return "\n".join(texts)
+    return "\n".join(note.text.strip() for note in _XP_APP_NOTE_EN(div) if note.text)
 
 def extract_bibliography(div):
     """
     Extract and join text from each <bibl> element.
     """
-    texts = []
     if div is None:
         return ""
-    for bibl in div.findall(".//tei:bibl", NS):
-        if bibl.text:
-            texts.append(bibl.text.strip())
-    return "\n".join(texts)
+    return "\n".join(bibl.text.strip() for bibl in _XP_BIBL(div) if bibl.text)
+
+@dataclass(frozen=True)
+class DocRecord:
+    """
+    Fields extracted from a single TEI document for display in the visualization tab.
+    Plain strings and tuples only, so its fields can be cached across Streamlit reruns as a dict.
+    """
+    mon_id: str
+    monument_title: str
+    editor_str: str
+    object_type: str
+    material: str
+    institution: str
+    inventory: str
+    height: str
+    width: str
+    depth: str
+    letter_size: str
+    layout: str
+    find_place: str
+    origin: str
+    dating: str
+    inscription_category: str
+    has_facsimiles: bool
+    facsimile_urls: Tuple[str, ...]
+    leiden_text: str
+    apparatus_text: str
+    translation_text: str
+    commentary_text: str
+    bibliography_text: str
+
+def extract_document(root):
+    """
+    Extract every field shown in the visualization tab from a parsed TEI document.
+    """
+
+    # --- Extract key sections from the TEI header ---
+    sections = collect_sections(root)
+    title_stmt = sections.get("titleStmt")
+    publication_stmt = sections.get("publicationStmt")
+
+    # Monument Title using the idno from publicationStmt.
+    mon_id = get_text(publication_stmt, "tei:idno[@type='filename']")
+    monument_title = f"Monument {mon_id}" if mon_id else "Monument"
+
+    editors = _XP_EDITOR_NAMES(title_stmt) if title_stmt is not None else []
+    editor_names = [ed.text.strip() for ed in editors if ed.text]
+    editor_str = ", ".join(editor_names) if editor_names else "Not available"
+
+    # --- Extract information from physDesc ---
+    object_type, material = child_texts(sections.get("support"), ("objectType", "material"), lang="en")
+
+    ms_identifier = sections.get("msIdentifier")
+    alt_identifiers = _XP_ALT_IDENTIFIER_EN(ms_identifier) if ms_identifier is not None else []
+    alt_identifier = alt_identifiers[0] if alt_identifiers else None
+    institution = xpath_text(alt_identifier, _XP_REPOSITORY_REF)
+    inventory = get_text(alt_identifier, "tei:idno")
+
+    height, width, depth = validate_dimensions(sections.get("dimensions"))
+    letter_size, = child_texts(sections.get("handNote"), ("height",))
+    layout, = child_texts(sections.get("layoutDesc"), ("layout",), lang="en")
+
+    find_place = xpath_text(sections.get("history"), _XP_FOUND_PLACE_EN)
+    origin_elem = sections.get("origin")
+    origin = xpath_text(origin_elem, _XP_ORIG_PLACE_EN)
+    dating = xpath_text(origin_elem, _XP_ORIG_DATE_EN)
+    inscription_category = xpath_text(sections.get("summary"), _XP_SEG_EN)
+
+    # --- Extract textual content from the body element ---
+    body_elem = sections.get("body")
+
+    # One dict of body divs keyed by @type; only the Greek edition counts as "edition"
+    divs = {}
+    if body_elem is not None:
+        divs = {
+            div.get("type", ""): div
+            for div in body_elem.iterchildren(_DIV_TAG)
+            if div.get("type") != "edition" or div.get(_XML_LANG) == "grc"
+        }
+    edition_div = divs.get("edition")
+    apparatus_div = divs.get("apparatus")
+    translation_div = divs.get("translation")
+    commentary_div = divs.get("commentary")
+    biblio_div = divs.get("bibliography")
+
+    if edition_div is not None:
+        leiden_text = format_leiden_text(edition_div)
+    else:
+        leiden_text = "No Greek edition text available."
+
+    apparatus_text = extract_apparatus_english(apparatus_div)
+    translation_text = extract_english_text(translation_div, "seg")
+    commentary_text = extract_english_text(commentary_div, "seg")
+    bibliography_text = extract_bibliography(biblio_div)
+
+    facsimiles = _XP_FACSIMILES(root)
+    image_urls = []
+    for fac in facsimiles:
+        urls = _XP_GRAPHIC_URL(fac)
+        if urls and urls[0]:
+            image_urls.append(str(urls[0]))
+
+    return DocRecord(
+        mon_id=mon_id,
+        monument_title=monument_title,
+        editor_str=editor_str,
+        object_type=object_type,
+        material=material,
+        institution=institution,
+        inventory=inventory,
+        height=height,
+        width=width,
+        depth=depth,
+        letter_size=letter_size,
+        layout=layout,
+        find_place=find_place,
+        origin=origin,
+        dating=dating,
+        inscription_category=inscription_category,
+        has_facsimiles=bool(facsimiles),
+        facsimile_urls=tuple(image_urls),
+        leiden_text=leiden_text,
+        apparatus_text=apparatus_text,
+        translation_text=translation_text,
+        commentary_text=commentary_text,
+        bibliography_text=bibliography_text
+    )
+
+def fold_text(text):
+    """
+    Canonicalize text for search matching: decompose it, drop combining marks (Greek accents
+    and breathings, the Leiden+ underdot of unclear letters), recompose and casefold.
+    Searchable entries are folded once when extracted, queries once per search.
+    """
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return unicodedata.normalize("NFC", stripped).casefold()
+
+# Word tokens indexed for search; any term made only of these characters lies inside one token
+_TOKEN_RE = re.compile(r"\w+")
+
+# Body sections matched by the search tab, as (div @type, label, text extractor,
+# DocRecord field already holding the text of the last such div)
+_SEARCH_TEXT_SECTIONS = (
+    ("edition", "Greek Text", format_leiden_text, "leiden_text"),
+    ("translation", "Translation", lambda div: extract_english_text(div, "seg"), "translation_text"),
+    ("commentary", "Commentary", lambda div: extract_english_text(div, "seg"), "commentary_text"),
+    ("bibliography", "Bibliography", extract_bibliography, "bibliography_text"),
+)
+
+def extract_searchable(root, doc):
+    """
+    Extract every text the search tab can match from a parsed TEI document, reusing the
+    texts already formatted for its DocRecord. Returns a dict with "entries", a list of
+    (search field, section label, text, folded text) tuples, monument fields first and then
+    the body sections, and "postings", which maps each folded word token to the indices of
+    the entries containing it (see fold_text).
+    """
+    entries = []
+
+    # Monument information, taken from the DocRecord rather than read from msDesc again
+    for label, text in (("Monument Type", doc.object_type), ("Material", doc.material), ("Origin", doc.origin)):
+        if text:
+            entries.append(("Monument Information", label, text, fold_text(text)))
+
+    # Text sections from the body divs, all selected in one XPath pass and grouped by type;
+    # the label doubles as the search field name. The cached DocRecord already holds the
+    # formatted text of the last div of each type, so only earlier divs are formatted here.
+    divs_by_type = defaultdict(list)
+    for div in _XP_SEARCHABLE_DIVS(root):
+        divs_by_type[div.get("type")].append(div)
+    for div_type, label, extract, doc_field in _SEARCH_TEXT_SECTIONS:
+        divs = divs_by_type[div_type]
+        for div_index, div in enumerate(divs):
+            text = getattr(doc, doc_field) if div_index == len(divs) - 1 else extract(div)
+            if text:
+                entries.append((label, label, text, fold_text(text)))
+
+    postings = defaultdict(list)
+    for entry_id, entry in enumerate(entries):
+        for token in set(_TOKEN_RE.findall(entry[3])):
+            postings[token].append(entry_id)
+
+    return {
+        "entries": entries,
+        "postings": dict(postings),
+    }
+
+@st.cache_data(show_spinner=False)
+def load_tei(file_name, file_bytes):
+    """
+    Parse, validate and extract one TEI file, cached so reruns skip files already seen.
+    Returns (usable, problems, fields, searchable); fields is a DocRecord as a plain dict.
+    """
+    try:
+        root = etree.fromstring(file_bytes, _LXML_PARSER)
+    except etree.XMLSyntaxError as e:
+        return False, [("error", f"XML Parsing Error in file {file_name}: {str(e)}")], None, None
+    except Exception as e:
+        return False, [("error", f"Error processing file {file_name}: {str(e)}")], None, None
+    usable, problems = validate_tei(file_name, root)
+    if not usable:
+        return usable, problems, None, None
+    doc = extract_document(root)
+    return usable, problems, asdict(doc), extract_searchable(root, doc)
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def build_search_index(file_keys, _searchables):
+    """
+    Merge the per-file token postings into one inverted index over all uploaded files.
+    Returns a dict with "postings", mapping each token to a list of (file index, entry index)
+    pairs, "tokens", the indexed tokens in a fixed order, "token_text", those tokens joined by
+    newlines so a substring can be located in all of them with one str.find scan, and
+    "token_starts", the offset of each token in token_text.
+    Cached on file_keys, one content digest per file in upload order, and shared without
+    copying, so reruns reuse it; the index is only read after it is built.
+    """
+    postings = defaultdict(list)
+    for file_index, searchable in enumerate(_searchables):
+        for token, entry_ids in searchable["postings"].items():
+            postings[token].extend((file_index, entry_id) for entry_id in entry_ids)
+    tokens = list(postings)
+    token_starts = []
+    offset = 0
+    for token in tokens:
+        token_starts.append(offset)
+        offset += len(token) + 1
+    return {
+        "postings": postings,
+        "tokens": tokens,
+        "token_text": "\n".join(tokens),
+        "token_starts": token_starts,
+    }
+
+def tokens_containing(search_index, run):
+    """
+    Yield every indexed token that contains run, a string of word characters.
+    Tokens never contain a newline, so each match in token_text lies inside a single token;
+    the scan then resumes after that token, so every token is reported once. A single
+    character is in a large share of the tokens, so those are checked one by one instead.
+    """
+    tokens = search_index["tokens"]
+    if len(run) == 1:
+        yield from (token for token in tokens if run in token)
+        return
+    token_starts = search_index["token_starts"]
+    token_text = search_index["token_text"]
+    position = token_text.find(run)
+    while position != -1:
+        token_id = bisect_right(token_starts, position) - 1
+        token = tokens[token_id]
+        yield token
+        position = token_text.find(run, token_starts[token_id] + len(token) + 1)
+
+def search_entries(search_index, searchables, term_folded, search_field="All Fields"):
+    """
+    Find every searchable entry in search_field whose folded text contains term_folded.
+    Returns a dict mapping file index to the set of matching entry indices.
+    Entries outside the selected field are skipped before any text is compared.
+    Every run of word characters in the term can only occur inside a single token, so the
+    entries holding a token that contains the longest run are found from the index vocabulary,
+    located with one scan over all tokens (see tokens_containing).
+    A term that is exactly one run is answered from the index alone; a longer term, such as a
+    multi-word vocabulary entry, is then checked against those candidate entries only.
+    Terms without any word characters fall back to scanning all entries.
+    """
+    any_field = search_field == "All Fields"
+    hits = defaultdict(set)
+    runs = _TOKEN_RE.findall(term_folded)
+    if runs:
+        longest_run = max(runs, key=len)
+        exact = longest_run == term_folded
+        postings = search_index["postings"]
+        for token in tokens_containing(search_index, longest_run):
+            for file_index, entry_id in postings[token]:
+                entry = searchables[file_index]["entries"][entry_id]
+                if (any_field or entry[0] == search_field) and (exact or term_folded in entry[3]):
+                    hits[file_index].add(entry_id)
+    else:
+        for file_index, searchable in enumerate(searchables):
+            for entry_id, entry in enumerate(searchable["entries"]):
+                if (any_field or entry[0] == search_field) and term_folded in entry[3]:
+                    hits[file_index].add(entry_id)
+    return hits
+
+# Columns of the analytics table; each row in all_data is a tuple in this order
+ANALYTICS_COLUMNS = ['Title', 'Type', 'Material', 'Origin', 'Date', 'Category']
+# Reads one analytics row from a DocRecord, in ANALYTICS_COLUMNS order
+analytics_row = attrgetter('monument_title', 'object_type', 'material', 'origin', 'dating', 'inscription_category')
+# Analytics columns that repeat a small vocabulary across documents
+CATEGORICAL_COLUMNS = ['Type', 'Material', 'Origin', 'Category']
+
+@st.cache_data(show_spinner=False)
+def build_analytics_frame(rows):
+    """
+    Build the analytics DataFrame and the type/material counts from a tuple of row tuples.
+    Empty fields are replaced with 'Not available' in one vectorized step, and the columns
+    with few distinct values are stored as categoricals (in order of first appearance, so
+    the counts and charts come out the same as with plain strings).
+    Cached on the rows, so tab switches and searches reuse the frame instead of rebuilding it.
+    """
+    df = pd.DataFrame(list(rows), columns=ANALYTICS_COLUMNS)
+    df = df.replace('', 'Not available')
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = pd.Categorical(df[column], categories=pd.unique(df[column]))
+    return df, df['Type'].value_counts(), df['Material'].value_counts()
+
+@st.cache_data(show_spinner=False)
+def build_distribution_figures(rows):
+    """
+    Build the monument type bar chart and the material pie chart from a tuple of analytics
+    row tuples, using the value counts computed once by build_analytics_frame.
+    """
+    _, type_counts, material_counts = build_analytics_frame(rows)
+    fig_types = px.bar(
+        x=type_counts.index, 
+        y=type_counts.values,
+        title="Monument Types Distribution",
+        labels={'x': 'Type', 'y': 'Count'}
+    )
+    fig_materials = px.pie(
+        values=material_counts.values,
+        names=material_counts.index,
+        title="Materials Distribution"
+    )
+    return fig_types, fig_materials
+
+@st.cache_data(show_spinner=False)
+def build_timeline_figure(rows):
+    """
+    Build the monuments timeline scatter plot from a tuple of analytics row tuples.
+    Points are drawn with WebGL (Scattergl) rather than one SVG node each, and the
+    figure is cached on the rows so reruns do not rebuild it. Plotly groups the points
+    with pandas, which warns about categorical keys, so it gets the columns as plain strings.
+    """
+    df, _, _ = build_analytics_frame(rows)
+    return px.scatter(
+        df.astype({column: object for column in CATEGORICAL_COLUMNS}),
+        x='Date',
+        y='Category',
+        color='Type',
+        hover_data=['Title', 'Material'],
+        title="Monuments Timeline",
+        render_mode='webgl'
+    )
+
+THUMBNAIL_WIDTH = 150
+
+# Upper bound on distinct terms kept per search vocabulary; the dropdowns cannot usefully show more
+MAX_SEARCH_TERMS = 500
+
+def vocabulary_terms(values):
+    """
+    Return the distinct non-empty values of a Series, lowercased and sorted, keeping only the
+    first MAX_SEARCH_TERMS in upload order.
+    """
+    lowered = values[values != ""].str.lower()
+    return sorted(pd.unique(lowered)[:MAX_SEARCH_TERMS])
+
+@st.cache_data(show_spinner=False)
+def build_search_vocabularies(rows):
+    """
+    Build the type, material and category vocabularies of the search dropdowns, column-wise,
+    from a tuple of analytics row tuples. Cached on the rows, so reruns reuse them.
+    """
+    df = pd.DataFrame(list(rows), columns=ANALYTICS_COLUMNS, dtype=object)
+    return vocabulary_terms(df['Type']), vocabulary_terms(df['Material']), vocabulary_terms(df['Category'])
+
+# Characters of context kept on each side of the match in the search results table
+SEARCH_SNIPPET_CONTEXT = 80
+
+# Folded form of single characters, for mapping folded offsets back onto the original text;
+# memoized for the current script run, which is enough since snippets repeat the same letters
+fold_char = lru_cache(maxsize=None)(fold_text)
+
+# Characters folded at a time while looking for the match in a snippet's text
+SNIPPET_FOLD_BLOCK = 256
+
+def match_snippet(text, term_folded, context=SEARCH_SNIPPET_CONTEXT):
+    """
+    Cut the part of text around the first occurrence of term_folded, keeping up to context
+    characters on either side and marking dropped text with ellipses. Folding drops accents and
+    may change lengths, so the text is folded one character at a time to map the match back onto
+    it, a block at a time and only until the match is found; if the term cannot be located that
+    way, the snippet is taken from the start of the text.
+    """
+    if len(text) <= 2 * context + len(term_folded):
+        return text
+    starts = []
+    folded = ""
+    position = -1
+    for block_start in range(0, len(text), SNIPPET_FOLD_BLOCK):
+        # A match may begin in the previous block and end in this one
+        search_from = max(0, len(folded) - len(term_folded))
+        pieces = []
+        offset = len(folded)
+        for ch in text[block_start:block_start + SNIPPET_FOLD_BLOCK]:
+            starts.append(offset)
+            piece = fold_char(ch)
+            pieces.append(piece)
+            offset += len(piece)
+        folded += "".join(pieces)
+        position = folded.find(term_folded, search_from)
+        if position != -1:
+            break
+    if position == -1:
+        first, last = 0, context
+    else:
+        first = bisect_right(starts, position) - 1
+        last = bisect_left(starts, position + len(term_folded))
+    begin = max(0, first - context)
+    end = min(len(text), last + context)
+    return ("…" if begin > 0 else "") + text[begin:end] + ("…" if end < len(text) else "")
+
+def group_names_by_id(names, ids):
+    """
+    Map each lowercased id to the names that contain it, case-insensitively, in the given order.
+    Every name is scanned once, one window per distinct id length, so the cost does not grow
+    with the number of documents.
+    """
+    keys = {doc_id.lower() for doc_id in ids if doc_id}
+    lengths = {len(key) for key in keys}
+    grouped = defaultdict(list)
+    for name in names:
+        lowered = name.lower()
+        windows = {lowered[start:start + length] for length in lengths for start in range(len(lowered) - length + 1)}
+        for key in windows & keys:
+            grouped[key].append(name)
+    return grouped
+
+@st.cache_data(show_spinner=False)
+def make_thumbnail(image_bytes):
+    """
+    Decode an image once and return a JPEG thumbnail for the image grids, as encoded bytes, so
+    st.image does not have to re-encode it on every rerun. Only the thumbnail is cached; the
+    full-size view is shown from the bytes the caller already holds.
+    """
+    with Image.open(BytesIO(image_bytes)) as image:
+        image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True)
+    return buffer.getvalue()
+
+def show_full_size(image, caption, key):
+    """
+    Show an image at full size inside a collapsed "View full size" expander. The expander reruns
+    the app when toggled and the image is only sent to the browser while it is open.
+    """
+    with st.expander("View full size", key=key, on_change="rerun") as expander:
+        if expander.open:
+            st.image(image, caption=caption, width="stretch")
 
 st.title("ENCODE EpiDoc")
 
@@ -374,11 +953,16 @@ with col2:
 
 image_data = {}
 if uploaded_images:
+    # Images with identical content are decoded, and looked up in the cache, only once
+    thumbnails = {}
     for img in uploaded_images:
         try:
-            
+            image_bytes = img.getvalue()
+            if image_bytes not in thumbnails:
+                thumbnails[image_bytes] = make_thumbnail(image_bytes)
             image_data[img.name] = {
-                'data': img,
+                'full': image_bytes,
+                'thumb': thumbnails[image_bytes],
                 'type': img.type
             }
         except Exception as e:
@@ -388,196 +972,74 @@ if uploaded_files:
     viz_tab, query_tab, analytics_tab = st.tabs(["Data Visualization", "Search & Query", "Analytics"])
     
     all_data = []
-    unique_types = set()
-    unique_materials = set()
-    unique_categories = set()
     parsed_files = []  
     
+    # Files with identical name and content are loaded once per rerun; each new file is
+    # parsed once, and diagnostics are shown in upload order
+    loaded = {}
     for uploaded_file in uploaded_files:
-        uploaded_file.seek(0)
-        root, raw_xml = parse_tei(uploaded_file)
-        if root is not None:
+        data = uploaded_file.getvalue()
+        upload_key = (uploaded_file.name, data)
+        if upload_key not in loaded:
+            usable, problems, fields, searchable = load_tei(*upload_key)
+            loaded[upload_key] = (usable, problems, DocRecord(**fields) if usable else None, searchable)
+        usable, problems, doc, searchable = loaded[upload_key]
+        _diagnostics.extend(problems)
+        if usable:
             # Store the parsed data
             parsed_files.append({
                 'name': uploaded_file.name,
-                'root': root,
-                'raw_xml': raw_xml
+                'data': data,
+                'doc': doc,
+                'searchable': searchable
             })
-            ms_desc = root.find(".//tei:msDesc", NS)
-            if ms_desc is not None:
-                # Collect monument type
-                object_type = get_text(ms_desc, ".//tei:objectType", lang="en")
-                if object_type:
-                    unique_types.add(object_type.lower())
-                
-                # Collect material
-                material = get_text(ms_desc, ".//tei:material", lang="en")
-                if material:
-                    unique_materials.add(material.lower())
-                
-                # Collect category
-                summary = ms_desc.find(".//tei:summary", NS)
-                if summary is not None:
-                    category = get_text(summary, ".//tei:seg", lang="en")
-                    if category:
-                        unique_categories.add(category.lower())
+            # One analytics row, also the source of the search dropdowns; it comes from the
+            # cached extraction, so reruns do not walk the tree again
+            all_data.append(analytics_row(doc))
+    flush_diagnostics()
+
+    unique_types, unique_materials, unique_categories = build_search_vocabularies(tuple(all_data))
+
+    searchables = [file_data['searchable'] for file_data in parsed_files]
     
     with viz_tab:
-        for file_data in parsed_files:
+        # Uploaded images grouped by the monument ids they mention, built once for all documents
+        images_by_mon_id = group_names_by_id(image_data, (file_data['doc'].mon_id for file_data in parsed_files))
+        for i, file_data in enumerate(parsed_files):
             st.markdown("---")
             st.header(f"Document: {file_data['name']}")
             
-            root = file_data['root']
-            raw_xml = file_data['raw_xml']
-
-            # --- Extract key sections from the TEI header ---
-            tei_header = root.find("tei:teiHeader", NS)
-            file_desc = tei_header.find("tei:fileDesc", NS) if tei_header is not None else None
-            title_stmt = file_desc.find("tei:titleStmt", NS) if file_desc is not None else None
-            publication_stmt = file_desc.find("tei:publicationStmt", NS) if file_desc is not None else None
-            source_desc = file_desc.find("tei:sourceDesc", NS) if file_desc is not None else None
-            ms_desc = source_desc.find("tei:msDesc", NS) if source_desc is not None else None
-
-            # Monument Title using the idno from publicationStmt.
-            mon_id = get_text(publication_stmt, "tei:idno[@type='filename']")
-            monument_title = f"Monument {mon_id}" if mon_id else "Monument"
-
-            editors = title_stmt.findall("tei:editor/tei:persName", NS) if title_stmt is not None else []
-            editor_names = [ed.text.strip() for ed in editors if ed.text]
-            editor_str = ", ".join(editor_names) if editor_names else "Not available"
-
-            # --- Extract information from physDesc ---
-            phys_desc = ms_desc.find("tei:physDesc", NS) if ms_desc is not None else None
-            object_desc = phys_desc.find("tei:objectDesc", NS) if phys_desc is not None else None
-            support_desc = object_desc.find("tei:supportDesc", NS) if object_desc is not None else None
-            support = support_desc.find("tei:support", NS) if support_desc is not None else None
-            object_type = get_text(support, "tei:objectType", lang="en")
-            material = get_text(support, "tei:material", lang="en")
-
-            ms_identifier = ms_desc.find("tei:msIdentifier", NS) if ms_desc is not None else None
-            alt_identifier = ms_identifier.find("tei:altIdentifier[@xml:lang='en']", NS) if ms_identifier is not None else None
-            institution = ""
-            repository = alt_identifier.find("tei:repository", NS) if alt_identifier is not None else None
-            if repository is not None:
-                ref = repository.find("tei:ref", NS)
-                if ref is not None and ref.text:
-                    institution = ref.text.strip()
-            inventory = get_text(alt_identifier, "tei:idno")
-
-            dimensions = support.find("tei:dimensions", NS) if support is not None else None
-            height = dimensions.find("tei:height", NS).text.strip() if dimensions is not None and dimensions.find("tei:height", NS) is not None else ""
-            width = dimensions.find("tei:width", NS).text.strip() if dimensions is not None and dimensions.find("tei:width", NS) is not None else ""
-            depth = dimensions.find("tei:depth", NS).text.strip() if dimensions is not None and dimensions.find("tei:depth", NS) is not None else ""
-
-            hand_desc = phys_desc.find("tei:handDesc", NS) if phys_desc is not None else None
-            hand_note = hand_desc.find("tei:handNote", NS) if hand_desc is not None else None
-            letter_size = hand_note.find("tei:height", NS).text.strip() if hand_note is not None and hand_note.find("tei:height", NS) is not None else ""
-
-            layout_desc = object_desc.find("tei:layoutDesc", NS) if object_desc is not None else None
-            layout = get_text(layout_desc, "tei:layout", lang="en")
-
-            history = ms_desc.find("tei:history", NS) if ms_desc is not None else None
-            provenance_found = None
-            if history is not None:
-                for prov in history.findall("tei:provenance", NS):
-                    if prov.attrib.get("type", "") == "found":
-                        provenance_found = prov
-                        break
-            find_place = ""
-            if provenance_found is not None:
-                seg = provenance_found.find("tei:seg[@xml:lang='en']", NS)
-                if seg is not None and seg.text:
-                    find_place = seg.text.strip()
-
-            origin = ""
-            if history is not None:
-                origin_elem = history.find("tei:origin", NS)
-                if origin_elem is not None:
-                    orig_place = origin_elem.find("tei:origPlace", NS)
-                    if orig_place is not None:
-                        seg = orig_place.find("tei:seg[@xml:lang='en']", NS)
-                        if seg is not None and seg.text:
-                            origin = seg.text.strip()
-
-            dating = ""
-            if history is not None:
-                origin_elem = history.find("tei:origin", NS)
-                if origin_elem is not None:
-                    orig_date = origin_elem.find("tei:origDate", NS)
-                    if orig_date is not None:
-                        seg = orig_date.find("tei:seg[@xml:lang='en']", NS)
-                        if seg is not None and seg.text:
-                            dating = seg.text.strip()
-
-            ms_contents = ms_desc.find("tei:msContents", NS) if ms_desc is not None else None
-            summary = ms_contents.find("tei:summary", NS) if ms_contents is not None else None
-            inscription_category = ""
-            if summary is not None:
-                seg = summary.find("tei:seg[@xml:lang='en']", NS)
-                if seg is not None and seg.text:
-                    inscription_category = seg.text.strip()
-
-            # --- Extract textual content from the body element ---
-            text_elem = root.find("tei:text", NS)
-            body_elem = text_elem.find("tei:body", NS) if text_elem is not None else None
-
-            edition_div = None 
-            apparatus_div = None
-            translation_div = None
-            commentary_div = None
-            biblio_div = None
-
-            if body_elem is not None:
-                for div in body_elem.findall("tei:div", NS):
-                    div_type = div.attrib.get("type", "")
-                    if div_type == "edition" and div.attrib.get("{http://www.w3.org/XML/1998/namespace}lang") == "grc":
-                        edition_div = div
-                    elif div_type == "apparatus":
-                        apparatus_div = div
-                    elif div_type == "translation":
-                        translation_div = div
-                    elif div_type == "commentary":
-                        commentary_div = div
-                    elif div_type == "bibliography":
-                        biblio_div = div
-
-            if edition_div is not None:
-                leiden_text = format_leiden_text(edition_div)
-            else:
-                leiden_text = "No Greek edition text available."
-
-            apparatus_text = extract_apparatus_english(apparatus_div)
-            translation_text = extract_english_text(translation_div, "seg")
-            commentary_text = extract_english_text(commentary_div, "seg")
-            bibliography_text = extract_bibliography(biblio_div)
+            doc = file_data['doc']
 
             # --- Display the information ---
-            st.header(monument_title)
+            st.header(doc.monument_title)
+            # Each bullet list is sent as one markdown element rather than one per line
             st.subheader("Monument Information")
-            st.markdown(f"- **Editor(s):** {editor_str}")
-            st.markdown(f"- **Type of monument:** {object_type if object_type else 'Not available'}")
-            st.markdown(f"- **Material:** {material if material else 'Not available'}")
-            st.markdown(f"- **Find place:** {find_place if find_place else 'Not available'}")
-            st.markdown(f"- **Origin:** {origin if origin else 'Not available'}")
-            st.markdown(f"- **Institution and Inventory:** {institution} No {inventory}")
-            st.markdown(f"- **Dimensions:** Height {height} cm, width {width} cm, depth {depth} cm")
-            st.markdown(f"- **Letter size:** Height {letter_size} cm")
-            st.markdown(f"- **Layout description:** {layout if layout else 'Not available'}")
-            st.markdown("- **Decoration description:** (appears to be blank)")
+            st.markdown("\n".join((
+                f"- **Editor(s):** {doc.editor_str}",
+                f"- **Type of monument:** {doc.object_type if doc.object_type else 'Not available'}",
+                f"- **Material:** {doc.material if doc.material else 'Not available'}",
+                f"- **Find place:** {doc.find_place if doc.find_place else 'Not available'}",
+                f"- **Origin:** {doc.origin if doc.origin else 'Not available'}",
+                f"- **Institution and Inventory:** {doc.institution} No {doc.inventory}",
+                f"- **Dimensions:** Height {doc.height} cm, width {doc.width} cm, depth {doc.depth} cm",
+                f"- **Letter size:** Height {doc.letter_size} cm",
+                f"- **Layout description:** {doc.layout if doc.layout else 'Not available'}",
+                "- **Decoration description:** (appears to be blank)",
+            )))
             
             st.subheader("Text and Dating Information")
-            st.markdown(f"- **Category of inscription:** {inscription_category}")
-            st.markdown(f"- **Dating criteria:** lettering")
-            st.markdown(f"- **Date:** {dating if dating else 'Not available'}")
+            st.markdown("\n".join((
+                f"- **Category of inscription:** {doc.inscription_category}",
+                "- **Dating criteria:** lettering",
+                f"- **Date:** {doc.dating if doc.dating else 'Not available'}",
+            )))
 
             st.subheader("Facsimiles and Images")
             
             matching_images = []
-            if mon_id:
-                for img_name, img_info in image_data.items():
-                    
-                    if mon_id.lower() in img_name.lower():
-                        matching_images.append((img_name, img_info))
+            if doc.mon_id:
+                matching_images = [(img_name, image_data[img_name]) for img_name in images_by_mon_id.get(doc.mon_id.lower(), ())]
             
             if matching_images:
                 st.markdown("**Uploaded Images:** *(Click thumbnails to view full size)*")
@@ -586,26 +1048,17 @@ if uploaded_files:
                     try:
                         
                         with cols[idx % 3]:
-                            st.image(img_info['data'], 
+                            st.image(img_info['thumb'], 
                                    caption=f"Uploaded: {img_name}", 
-                                   width=150)
-                            with st.expander("View full size"):
-                                st.image(img_info['data'], 
-                                       caption=f"Full size: {img_name}", 
-                                       use_column_width=True)
+                                   width=THUMBNAIL_WIDTH)
+                            show_full_size(img_info['full'], f"Full size: {img_name}", key=f"full_upload_{i}_{idx}")
                     except Exception as e:
                         st.warning(f"Could not display uploaded image {img_name}: {str(e)}")
             
             # Checks facsimile element in the XML structure for relevant data
             st.markdown("**XML-Referenced Facsimiles:** *(Click thumbnails to view full size)*")
-            facsimiles = root.findall("tei:facsimile", NS)
-            if facsimiles:
-                image_urls = []
-                for fac in facsimiles:
-                    graphic = fac.find("tei:graphic", NS)
-                    if graphic is not None and graphic.get("url"):
-                        image_urls.append(graphic.get("url"))
-                
+            if doc.has_facsimiles:
+                image_urls = doc.facsimile_urls
                 if image_urls:
                     cols = st.columns(3)  # Shows max 3 images per row
                     for idx, url in enumerate(image_urls):
@@ -614,33 +1067,28 @@ if uploaded_files:
                                 img_name = url.split('/')[-1]
                                 if img_name in image_data:
                                     
-                                    st.image(image_data[img_name]['data'], 
+                                    st.image(image_data[img_name]['thumb'], 
                                            caption=f"Facsimile {idx + 1}", 
-                                           width=150)
+                                           width=THUMBNAIL_WIDTH)
                                 
-                                    with st.expander("View full size"):
-                                        st.image(image_data[img_name]['data'], 
-                                               caption=f"Facsimile {idx + 1} (Full size)", 
-                                               use_column_width=True)
+                                    show_full_size(image_data[img_name]['full'], f"Facsimile {idx + 1} (Full size)",
+                                                   key=f"full_facsimile_{i}_{idx}")
                                 # If not found in uploads, try to load from URL/path, using correcting routes
                                 elif url.startswith(('/', '\\', 'C:', 'D:')):
                                     try:
-                                        with open(url, 'rb') as f:
-                                            # Display thumbnail
-                                            st.image(f, caption=f"Facsimile {idx + 1}", width=150)
-                                            # Add expandable version
-                                            with st.expander("View full size"):
-                                                st.image(f, caption=f"Facsimile {idx + 1} (Full size)", 
-                                                       use_column_width=True)
+                                        full = Path(url).read_bytes()
+                                        thumb = make_thumbnail(full)
+                                        # Display thumbnail
+                                        st.image(thumb, caption=f"Facsimile {idx + 1}", width=THUMBNAIL_WIDTH)
+                                        # Add expandable version
+                                        show_full_size(full, f"Facsimile {idx + 1} (Full size)", key=f"full_facsimile_{i}_{idx}")
                                     except Exception as e:
                                         st.warning(f"Could not load facsimile from local path: {url}. Error: {str(e)}")
                                 else:
-                                    # Display thumbnail for remote URLs
-                                    st.image(url, caption=f"Facsimile {idx + 1}", width=150)
+                                    # Display thumbnail for remote URLs; the browser loads them itself
+                                    st.image(url, caption=f"Facsimile {idx + 1}", width=THUMBNAIL_WIDTH)
                                     # Add expandable version
-                                    with st.expander("View full size"):
-                                        st.image(url, caption=f"Facsimile {idx + 1} (Full size)", 
-                                               use_column_width=True)
+                                    show_full_size(url, f"Facsimile {idx + 1} (Full size)", key=f"full_facsimile_{i}_{idx}")
                         except Exception as e:
                             st.warning(f"Could not load facsimile: {url}. Error: {str(e)}")
                 else:
@@ -648,60 +1096,54 @@ if uploaded_files:
             else:
                 st.write("No facsimile elements found in the document.")
 
-            st.subheader("Greek Text (Leiden+ formatted)")
-            st.markdown("The following text is rendered from the edition (Greek) section:")
-            st.text(leiden_text)
-
-            st.subheader("Translation (English)")
-            if translation_text:
-                st.text(translation_text)
-            else:
-                st.write("No translation available.")
-
-            st.subheader("Apparatus (English)")
-            if apparatus_text:
-                st.text(apparatus_text)
-            else:
-                st.write("No apparatus notes available.")
-
-            st.subheader("Commentary (English)")
-            if commentary_text:
-                st.text(commentary_text)
-            else:
-                st.write("No commentary available.")
-
-            st.subheader("Bibliography")
-            if bibliography_text:
-                st.text(bibliography_text)
-            else:
-                st.write("No bibliography available.")
-
+            # Text sections go in an expander, collapsed except for the first document, and are only
+            # rendered while it is open; st.code renders preformatted text more cheaply than st.text
+            with st.expander(f"Texts: {file_data['name']}", expanded=(i == 0), key=f"texts_{i}", on_change="rerun") as texts:
+                if texts.open:
+                    st.subheader("Greek Text (Leiden+ formatted)")
+                    st.markdown("The following text is rendered from the edition (Greek) section:")
+                    st.code(doc.leiden_text, language=None)
+
+                    st.subheader("Translation (English)")
+                    if doc.translation_text:
+                        st.code(doc.translation_text, language=None)
+                    else:
+                        st.write("No translation available.")
+
+                    # Only sections with content get elements; one line covers the case where all are empty
+                    notes_sections = (
+                        ("Apparatus (English)", doc.apparatus_text),
+                        ("Commentary (English)", doc.commentary_text),
+                        ("Bibliography", doc.bibliography_text),
+                    )
+                    for title, content in notes_sections:
+                        if content:
+                            st.subheader(title)
+                            st.code(content, language=None)
+                    if not any(content for _, content in notes_sections):
+                        st.write("No apparatus, commentary or bibliography available.")
+
+            # The bytes are handed over lazily, only when the button is clicked, instead of
+            # being registered with the media file manager for every file on every rerun
+            # Keyed by position, since duplicate uploads would otherwise get the same widget ID
             st.download_button(
                 label="Download Original XML",
-                data=raw_xml,
-                file_name=mon_id + ".xml" if mon_id else "tei_document.xml",
-                mime="text/xml"
+                data=lambda data=file_data['data']: data,
+                file_name=doc.mon_id + ".xml" if doc.mon_id else "tei_document.xml",
+                mime="text/xml",
+                key=f"download_xml_{i}"
             )
 
             
-            monument_data = {
-                'Title': monument_title,
-                'Type': object_type if object_type else 'Not available',
-                'Material': material if material else 'Not available',
-                'Origin': origin if origin else 'Not available',
-                'Date': dating if dating else 'Not available',
-                'Category': inscription_category if inscription_category else 'Not available'
-            }
-            all_data.append(monument_data)
 
     with query_tab:
         st.header("Search & Query TEI Documents")
         
         # Dynamic search categories from loaded documents
         search_categories = {
-            'Monument Types': sorted(list(unique_types)) if unique_types else ['No types found'],
-            'Materials': sorted(list(unique_materials)) if unique_materials else ['No materials found'],
-            'Categories': sorted(list(unique_categories)) if unique_categories else ['No categories found'],
+            'Monument Types': unique_types if unique_types else ['No types found'],
+            'Materials': unique_materials if unique_materials else ['No materials found'],
+            'Categories': unique_categories if unique_categories else ['No categories found'],
             'Custom Search': ['custom']
         }
         
@@ -709,86 +1151,49 @@ if uploaded_files:
         st.sidebar.subheader("Available Search Terms")
         if st.sidebar.checkbox("Show available terms"):
             st.sidebar.markdown("**Monument Types:**")
-            st.sidebar.write(sorted(list(unique_types)))
+            st.sidebar.write(unique_types)
             st.sidebar.markdown("**Materials:**")
-            st.sidebar.write(sorted(list(unique_materials)))
+            st.sidebar.write(unique_materials)
             st.sidebar.markdown("**Categories:**")
-            st.sidebar.write(sorted(list(unique_categories)))
+            st.sidebar.write(unique_categories)
         
         search_category = st.selectbox("Select search category", list(search_categories.keys()))
         
-        if search_category == 'Custom Search':
-            search_term = st.text_input("Enter custom search term")
-        else:
-            search_term = st.selectbox(f"Select {search_category}", search_categories[search_category])
-            
-        search_field = st.selectbox(
-            "Select where to search",
-            ["All Fields", "Monument Information", "Greek Text", "Translation", "Commentary", "Bibliography"]
-        )
+        # Term and field are submitted together, so typing does not rerun the search per keystroke;
+        # the last submitted search is kept in the session so other widgets do not clear its results
+        with st.form("search_form"):
+            if search_category == 'Custom Search':
+                search_term = st.text_input("Enter custom search term")
+            else:
+                search_term = st.selectbox(f"Select {search_category}", search_categories[search_category])
+                
+            search_field = st.selectbox(
+                "Select where to search",
+                ["All Fields", "Monument Information", "Greek Text", "Translation", "Commentary", "Bibliography"]
+            )
+            submitted = st.form_submit_button("Search")
         
         st.info("💡 Note: Monument Information includes type, material, origin, etc.")
 
+        if submitted:
+            st.session_state['submitted_search'] = (search_term, search_field)
+        search_term, search_field = st.session_state.get('submitted_search', ("", "All Fields"))
+
         if search_term and search_term != 'custom':
-            search_term_lower = search_term.lower().strip()
+            search_term_folded = fold_text(search_term.strip())
+            file_keys = tuple(hashlib.blake2b(file_data['data'], digest_size=16).digest() for file_data in parsed_files)
+            search_index = build_search_index(file_keys, searchables)
             results = []  # Store all matches here
+            hits = search_entries(search_index, searchables, search_term_folded, search_field)
             
-            for file_data in parsed_files:
-                root = file_data['root']
+            for file_index, file_data in enumerate(parsed_files):
                 file_name = file_data['name']
-                file_matches = []  # Store matches for this file
-                
-                # Extract monument information first
-                tei_header = root.find("tei:teiHeader", NS)
-                if tei_header is not None:
-                    ms_desc = tei_header.find(".//tei:msDesc", NS)
-                    if ms_desc is not None and search_field in ["All Fields", "Monument Information"]:
-                        # Check type
-                        object_type = get_text(ms_desc, ".//tei:objectType", lang="en")
-                        if object_type and search_term_lower in object_type.lower():
-                            file_matches.append(("Monument Type", object_type))
-                        
-                        # Check material
-                        material = get_text(ms_desc, ".//tei:material", lang="en")
-                        if material and search_term_lower in material.lower():
-                            file_matches.append(("Material", material))
-                        
-                        # Check origin
-                        origin = get_text(ms_desc, ".//tei:origin//tei:origPlace//tei:seg[@xml:lang='en']")
-                        if origin and search_term_lower in origin.lower():
-                            file_matches.append(("Origin", origin))
-                
-                # Search in text sections if needed
-                body_elem = root.find("tei:text/tei:body", NS)
-                if body_elem is not None:
-                    for div in body_elem.findall("tei:div", NS):
-                        div_type = div.attrib.get("type", "")
-                        
-                        # Search Greek Text
-                        if div_type == "edition" and search_field in ["Greek Text", "All Fields"]:
-                            if div.attrib.get("{http://www.w3.org/XML/1998/namespace}lang") == "grc":
-                                text = format_leiden_text(div)
-                                if text and search_term_lower in text.lower():
-                                    file_matches.append(("Greek Text", text))
-                        
-                        # Search Translation
-                        elif div_type == "translation" and search_field in ["Translation", "All Fields"]:
-                            text = extract_english_text(div, "seg")
-                            if text and search_term_lower in text.lower():
-                                file_matches.append(("Translation", text))
-                        
-                        # Search Commentary
-                        elif div_type == "commentary" and search_field in ["Commentary", "All Fields"]:
-                            text = extract_english_text(div, "seg")
-                            if text and search_term_lower in text.lower():
-                                file_matches.append(("Commentary", text))
-                        
-                        # Search Bibliography
-                        elif div_type == "bibliography" and search_field in ["Bibliography", "All Fields"]:
-                            text = extract_bibliography(div)
-                            if text and search_term_lower in text.lower():
-                                file_matches.append(("Bibliography", text))
-                
+                # Keep the matching entries of this file in extraction order
+                entries = file_data['searchable']['entries']
+                file_matches = [
+                    (entries[entry_id][1], entries[entry_id][2])
+                    for entry_id in sorted(hits.get(file_index, ()))
+                ]
                 
                 if file_matches:
                     results.append({
@@ -799,50 +1204,58 @@ if uploaded_files:
             # Only display results if any matches were found
             if results:
                 st.subheader("Search Results")
-                for result in results:
-                    with st.expander(f"Results from {result['file_name']}"):
-                        for section, content in result['matches']:
-                            st.markdown(f"**Found in {section}:**")
-                            st.text(content)
+                # One table for all matches by default; per-file expanders are opt-in
+                if st.checkbox("Group by file"):
+                    for result in results:
+                        with st.expander(f"Results from {result['file_name']}"):
+                            for section, content in result['matches']:
+                                st.markdown(f"**Found in {section}:**")
+                                st.text(content)
+                else:
+                    matches = [
+                        (result['file_name'], section, content)
+                        for result in results
+                        for section, content in result['matches']
+                    ]
+                    rows = [
+                        (file_name, section, match_snippet(content, search_term_folded))
+                        for file_name, section, content in matches
+                    ]
+                    # Selecting a row shows its full text below the table, so long matches need no extra widgets
+                    table = st.dataframe(
+                        pd.DataFrame(rows, columns=['File', 'Section', 'Match']),
+                        width="stretch",
+                        hide_index=True,
+                        on_select="rerun",
+                        selection_mode="single-row",
+                        key="search_results_table"
+                    )
+                    selected_rows = [row for row in table.selection.rows if row < len(matches)]
+                    if selected_rows:
+                        file_name, section, content = matches[selected_rows[0]]
+                        st.markdown(f"**Found in {section} ({file_name}):**")
+                        st.text(content)
             else:
                 st.info("No matches found for your search criteria.")
 
     with analytics_tab:
         st.header("Analytics & Visualizations")
         if all_data:
-            df = pd.DataFrame(all_data)
+            rows = tuple(all_data)
+            df, _, _ = build_analytics_frame(rows)
+            fig_types, fig_materials = build_distribution_figures(rows)
             
             # Create a bar chart of monument types
             st.subheader("Distribution of Monument Types")
-            type_counts = df['Type'].value_counts()
-            fig_types = px.bar(
-                x=type_counts.index, 
-                y=type_counts.values,
-                title="Monument Types Distribution",
-                labels={'x': 'Type', 'y': 'Count'}
-            )
             st.plotly_chart(fig_types)
             
             # Create a pie chart of materials
             st.subheader("Distribution of Materials")
-            material_counts = df['Material'].value_counts()
-            fig_materials = px.pie(
-                values=material_counts.values,
-                names=material_counts.index,
-                title="Materials Distribution"
-            )
             st.plotly_chart(fig_materials)
             
             # Create a timeline of monuments
             st.subheader("Timeline of Monuments")
-            fig_timeline = px.scatter(
-                df,
-                x='Date',
-                y='Category',
-                color='Type',
-                hover_data=['Title', 'Material'],
-                title="Monuments Timeline"
-            )
+            fig_timeline = build_timeline_figure(rows)
             st.plotly_chart(fig_timeline)
             
             